@@ -2,7 +2,8 @@ from math import floor
 import os
 import sys
 from pathlib import Path
-import dns.resolver
+import dns.asyncresolver
+import dns.exception
 import json
 import shutil
 import asyncio
@@ -21,9 +22,38 @@ from rich.progress import (
     TimeRemainingColumn,
 )
 from rich import print as rprint
+import atexit
 import ctypes
+import heapq
+import ipaddress
+import random
 import re
-from functools import wraps
+import time
+from functools import lru_cache, wraps
+from operator import itemgetter
+
+try:
+    import aiodns
+except ImportError:  # 未安装 aiodns 时使用 dnspython 自带的异步解析器
+    aiodns = None
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用标准库 json
+    orjson = None
+
+try:
+    if sys.platform.startswith("win"):
+        import winloop as uvloop
+    else:
+        import uvloop
+except ImportError:  # 未安装 uvloop / winloop 时使用 asyncio 默认事件循环
+    uvloop = None
+
+try:
+    import icmplib
+except ImportError:  # 未安装 icmplib 时只能使用 TCP 连接测试延迟
+    icmplib = None
 
 
 # -------------------- 常量设置 -------------------- #
@@ -32,12 +62,53 @@ HOSTS_NUM = 1  # 每个域名限定Hosts主机 ipv4 数量
 MAX_LATENCY = 300  # 允许的最大延迟
 PING_TIMEOUT = 1  # ping 超时时间
 NUM_PINGS = 4  # ping次数
+MAX_CONCURRENT_DNS = 32  # 同时进行的域名解析数量上限
+NEGATIVE_CACHE_TTL = 3600  # 域名无解析结果时的否定缓存时间 秒
+TIMEOUT_CACHE_TTL = 30  # 解析超时时的否定缓存时间 秒
+DNS_CACHE_DEFAULT_TTL = 86400  # 无 TTL 信息时 DNS 缓存的有效时间 秒
+DNS_CACHE_MIN_TTL = 300  # DNS 缓存的最短有效时间 秒
+IPADDRESS_CACHE_TTL = 7 * 86400  # ipaddress.com 查询结果的缓存时间 秒
+IPADDRESS_FAILURE_TTL = 3600  # ipaddress.com 查询失败后暂不重试的时间 秒
+IPADDRESS_MAX_TIMEOUTS = 3  # ipaddress.com 连续超时达到该次数后本次运行不再请求
+IPADDRESS_CONCURRENCY = 4  # 同时请求 ipaddress.com 的数量上限
+IPADDRESS_INTERVAL = 0.25  # 相邻两次请求 ipaddress.com 的最小间隔 秒
+DNS_CACHE_SAVE_INTERVAL = 5  # 两次写入 DNS 缓存文件的最小间隔 秒
+DNS_SERVERS_PER_QUERY = 2  # 每个域名同时查询的 DNS 服务器数量
+DNS_SERVER_MAX_FAILURES = 3  # DNS 服务器连续故障达到该次数后降低优先级
+DNS_HEDGE_DELAY = 0.5  # 选中的 DNS 服务器超过该时间未返回时，同时查询其余服务器 秒
+RETRY_MAX_DELAY = 8  # 重试退避的最大等待时间 秒
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}  # 可以重试的 HTTP 状态码
+IPV6_PROBE_ADDRESS = "2001:4860:4860::8888"  # 检测本机是否有 IPv6 路由时使用的地址
+ICMP_CONCURRENCY = 64  # ICMP 批量测试时同时 ping 的主机数量
+MAX_CONCURRENT_PROBES = 64  # 同时进行的延迟测试连接数量上限
+UPDATE_TIMEOUT = 300  # 处理全部域名组的总超时时间 秒
+
+# 匹配网页中的 IPv4 / IPv6 地址，合并为一个模式以便只扫描一遍
+IP_PATTERN = re.compile(
+    r"\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b"  # IPv4
+    r"|(?:[0-9a-fA-F]{1,4}:){7}[0-9a-fA-F]{1,4}"  # IPv6
+)
+# 匹配本工具写入 hosts 文件的标记块起止行，其余注释一律视为用户内容
+HOSTS_TAG_PATTERN = re.compile(r"# cnNetTool (Start|End)\b")
+# 匹配 rich 样式标记，如 [blue on green]、[/bold]，不会匹配 [完成]
+RICH_TAG_PATTERN = re.compile(r"\[/?[a-zA-Z_][^\]]*\]")
 
 # 初始化日志模块
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
 
 # -------------------- 解析参数 -------------------- #
+def positive_int(value: str) -> int:
+    """argparse 类型校验：只接受正整数"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的整数: {value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"必须为正整数: {value}")
+    return number
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description=(
@@ -75,6 +146,17 @@ def parse_args():
         type=int,
         help="设置允许的最大延迟（毫秒）",
     )
+    parser.add_argument(
+        "--max-concurrent-dns",
+        default=MAX_CONCURRENT_DNS,
+        type=positive_int,
+        help="限定同时进行的域名解析数量",
+    )
+    parser.add_argument(
+        "--icmp",
+        action="store_true",
+        help="使用 ICMP ping 测试延迟（需安装 icmplib），不可用时自动改用 TCP 连接测试",
+    )
     parser.add_argument(
         "-v",
         "--verbose",
@@ -94,6 +176,28 @@ class Utils:
     def is_ipv6(ip: str) -> bool:
         return ":" in ip
 
+    @staticmethod
+    def is_routable_ip(ip: str) -> bool:
+        """判断是否为可路由的公网 IP，排除回环、私有、链路本地、文档与组播地址"""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return address.is_global and not address.is_multicast
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def has_ipv6_route() -> bool:
+        """检测本机是否具备 IPv6 出口路由，UDP connect 只查路由表，不发送数据"""
+        if not socket.has_ipv6:
+            return False
+        try:
+            with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as sock:
+                sock.connect((IPV6_PROBE_ADDRESS, 53))
+            return True
+        except OSError:
+            return False
+
     @staticmethod
     def get_hosts_file_path() -> str:
         os_type = platform.system().lower()
@@ -157,6 +261,12 @@ class Utils:
         except Exception as e:
             print(f"生成 README.md 文件时发生错误: {str(e)}")
 
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def get_terminal_width() -> int:
+        """获取终端宽度，一次运行中只查询一次"""
+        return shutil.get_terminal_size().columns
+
     def get_formatted_line(char="-", color="green", width_percentage=0.97):
         """
         生成格式化的分隔线
@@ -167,7 +277,7 @@ class Utils:
             width_percentage: 终端宽度的百分比（0.0-1.0）
         """
         # 获取终端宽度
-        terminal_width = shutil.get_terminal_size().columns
+        terminal_width = Utils.get_terminal_width()
         # 计算目标宽度（终端宽度的指定百分比）
         target_width = floor(terminal_width * width_percentage)
 
@@ -187,14 +297,11 @@ class Utils:
             align_position: 终端宽度的百分比（0.0-1.0）
         """
         # 获取终端宽度并计算目标宽度
-        terminal_width = shutil.get_terminal_size().columns
+        terminal_width = Utils.get_terminal_width()
         target_width = floor(terminal_width * align_position)
 
         # 移除rich标记计算实际文本长度
-        plain_text = (
-            text.replace("[blue on green]", "").replace("[/blue on green]", "")
-            # .replace("[完成]", "")
-        )
+        plain_text = RICH_TAG_PATTERN.sub("", text)
 
         if "[完成]" in text:
             main_text = plain_text.strip()
@@ -228,119 +335,413 @@ class DomainGroup:
         group_type: GroupType = GroupType.SHARED,
     ):
         self.name = name
-        self.domains = domains if isinstance(domains, list) else [domains]
-        self.ips = ips or set()
+        # 配置在运行期间只读，统一转为不可变的 tuple / frozenset
+        self.domains = (domains,) if isinstance(domains, str) else tuple(domains)
+        # 预设 IP 在定义时校验并统一为规范写法，配置有误时导入即报错
+        self.ips = frozenset(ipaddress.ip_address(ip).compressed for ip in ips or ())
         self.group_type = group_type
 
 
 # -------------------- 域名解析模块 -------------------- #
 class DomainResolver:
-    # 设置缓存过期时间为1周
-    DNS_CACHE_EXPIRY_TIME = timedelta(weeks=1)
-
-    def __init__(self, dns_servers: List[str], max_latency: int, dns_cache_file: str):
+    def __init__(
+        self,
+        dns_servers: List[str],
+        max_latency: int,
+        dns_cache_file: str,
+        max_concurrent_dns: int = MAX_CONCURRENT_DNS,
+    ):
+        if not Utils.has_ipv6_route():
+            # 无 IPv6 路由时 IPv6 DNS 服务器必然超时，直接剔除
+            dns_servers = [
+                dns_server
+                for dns_server in dns_servers
+                if not Utils.is_ipv6(dns_server)
+            ]
+            logging.debug("未检测到 IPv6 路由，仅使用 IPv4 DNS 服务器")
         self.dns_servers = dns_servers
         self.max_latency = max_latency
         self.dns_cache_file = Path(dns_cache_file)
-        self.dns_records = self._init_dns_cache()
-
-    def _init_dns_cache(self) -> dict:
-        """初始化 DNS 缓存，如果缓存文件存在且未过期则加载，否则返回空字典"""
-        if self._is_dns_cache_valid():
-            return self.load_hosts_cache()
-        # 如果 DNS 缓存过期，删除旧缓存文件
-        if self.dns_cache_file.exists():
-            self.dns_cache_file.unlink()
-        return {}
-
-    def _is_dns_cache_valid(self) -> bool:
-        """检查 DNS 缓存是否有效"""
-        if not self.dns_cache_file.exists():
-            return False
+        self.dns_records = self.load_hosts_cache()
+        # DNS 缓存按间隔批量写入，退出时写入剩余的改动
+        self._cache_dirty = False
+        self._cache_saved_at = 0.0
+        atexit.register(self.flush_hosts_cache)
+        # 限制同时解析的域名数量，防止 UDP 查询过多导致大面积超时
+        self._resolve_sem = asyncio.Semaphore(max_concurrent_dns)
+        # 正在解析或已解析的域名，重复的请求直接复用同一结果
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # 复用同一个 HTTP 会话查询 ipaddress.com，首次使用时创建
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        # ipaddress.com 请求限速：限制并发数，并保证相邻请求的最小间隔
+        self._ipaddress_sem = asyncio.Semaphore(IPADDRESS_CONCURRENCY)
+        self._ipaddress_last = 0.0
+        # ipaddress.com 连续超时的请求数，达到上限后跳过其余请求
+        self._ipaddress_timeouts = 0
+        # 每个 DNS 服务器对应一个异步解析器，便于并发查询
+        self._resolvers = {
+            dns_server: self._create_resolver(dns_server)
+            for dns_server in self.dns_servers
+        }
+        # 各 DNS 服务器的连续故障次数，用于熔断频繁超时的服务器
+        self._server_failures: Dict[str, int] = {
+            dns_server: 0 for dns_server in self.dns_servers
+        }
+        # 提前返回后仍在进行的查询，保留引用直到其结束
+        self._background_queries: Set[asyncio.Future] = set()
 
-        file_age = datetime.now() - datetime.fromtimestamp(
-            os.path.getmtime(self.dns_cache_file)
-        )
-        return file_age <= self.DNS_CACHE_EXPIRY_TIME
+    @staticmethod
+    def _create_resolver(dns_server: str):
+        """创建只使用指定 DNS 服务器的异步解析器，优先使用基于 c-ares 的 aiodns"""
+        if aiodns is not None:
+            # 各服务器已并行查询，单个服务器只尝试一次，避免超时叠加
+            return aiodns.DNSResolver(
+                nameservers=[dns_server], timeout=RESOLVER_TIMEOUT, tries=1
+            )
+        resolver = dns.asyncresolver.Resolver(configure=False)
+        resolver.nameservers = [dns_server]
+        resolver.lifetime = RESOLVER_TIMEOUT
+        return resolver
+
+    async def _query(
+        self, dns_server: str, domain: str, qtype: str
+    ) -> Tuple[Set[str], Optional[int]]:
+        """查询单个 DNS 服务器的一种记录，返回 IP 集合与最小 TTL
+
+        超时抛出 asyncio.TimeoutError，服务器拒绝连接抛出 ConnectionRefusedError
+        """
+        resolver = self._resolvers[dns_server]
+        if aiodns is not None:
+            try:
+                answers = await resolver.query(domain, qtype)
+            except aiodns.error.DNSError as e:
+                if e.args[0] == aiodns.error.ARES_ETIMEOUT:
+                    raise asyncio.TimeoutError(str(e)) from e
+                if e.args[0] == aiodns.error.ARES_ECONNREFUSED:
+                    raise ConnectionRefusedError(str(e)) from e
+                raise
+            ips = {answer.host for answer in answers}
+            ttl = min((answer.ttl for answer in answers), default=None)
+            return ips, ttl
+
+        try:
+            answer = await resolver.resolve(domain, qtype, raise_on_no_answer=False)
+        except dns.exception.Timeout as e:
+            raise asyncio.TimeoutError(str(e)) from e
+        if answer.rrset is None:
+            return set(), None
+        return {rdata.address for rdata in answer.rrset}, answer.rrset.ttl
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """获取共享的 HTTP 会话，复用连接、DNS 缓存与 TLS 会话"""
+        if self._http_session is None or self._http_session.closed:
+            connector = aiohttp.TCPConnector(limit=32, ttl_dns_cache=3600)
+            self._http_session = aiohttp.ClientSession(connector=connector)
+        return self._http_session
+
+    async def aclose(self):
+        """关闭共享的 HTTP 会话，并写入尚未保存的 DNS 缓存"""
+        if self._http_session is not None and not self._http_session.closed:
+            await self._http_session.close()
+        self._http_session = None
+        self.flush_hosts_cache()
 
     def load_hosts_cache(self) -> Dict[str, Dict]:
+        """加载 DNS 缓存，各域名记录按自身的 expires_at 判断是否过期"""
+        if not self.dns_cache_file.exists():
+            return {}
         try:
-            with open(self.dns_cache_file, "r", encoding="utf-8") as f:
-                return json.load(f)
+            data = self.dns_cache_file.read_bytes()
+            records = orjson.loads(data) if orjson is not None else json.loads(data)
         except Exception as e:
             logging.error(f"加载 DNS 缓存文件失败: {e}")
             return {}
 
+        # 过期记录不会再被使用，加载时丢弃，避免缓存文件随已移除的域名不断增长
+        now = time.time()
+        return {
+            domain: record
+            for domain, record in records.items()
+            if self._is_unexpired(record.get("expires_at"), now)
+            or self._is_unexpired(record.get("negative_until"), now)
+            or self._is_unexpired(record.get("ipaddress_expires_at"), now)
+        }
+
     def save_hosts_cache(self):
+        """将 DNS 缓存写入临时文件后原子替换，避免写入中途出错导致缓存损坏"""
         try:
-            with open(self.dns_cache_file, "w", encoding="utf-8") as f:
-                json.dump(self.dns_records, f, indent=4, ensure_ascii=False)
+            if orjson is not None:
+                data = orjson.dumps(self.dns_records, option=orjson.OPT_INDENT_2)
+            else:
+                data = json.dumps(
+                    self.dns_records, indent=2, ensure_ascii=False
+                ).encode("utf-8")
+            temp_file = self.dns_cache_file.with_suffix(".tmp")
+            temp_file.write_bytes(data)
+            os.replace(temp_file, self.dns_cache_file)
+            self._cache_dirty = False
+            self._cache_saved_at = time.monotonic()
             logging.debug(f"成功保存 DNS 缓存到文件 {self.dns_cache_file}")
         except Exception as e:
             logging.error(f"保存 DNS 缓存到文件时发生错误: {e}")
 
-    async def resolve_domain(self, domain: str) -> Set[str]:
-        ips = set()
+    def _schedule_cache_save(self):
+        """标记 DNS 缓存有改动，距上次写入超过 DNS_CACHE_SAVE_INTERVAL 秒时才写入"""
+        self._cache_dirty = True
+        if time.monotonic() - self._cache_saved_at >= DNS_CACHE_SAVE_INTERVAL:
+            self.save_hosts_cache()
 
-        # 1. 首先通过常规DNS服务器解析
-        dns_ips = await self._resolve_via_dns(domain)
-        ips.update(dns_ips)
+    def flush_hosts_cache(self):
+        """写入尚未保存的 DNS 缓存改动"""
+        if self._cache_dirty:
+            self.save_hosts_cache()
+
+    async def resolve_domain(self, domain: str) -> Set[str]:
+        """解析域名，同一域名在一次运行中只解析一次"""
+        future = self._inflight.get(domain)
+        if future is None:
+            future = asyncio.ensure_future(self._resolve_domain(domain))
+            self._inflight[domain] = future
 
-        # 2. 然后通过DNS_records解析
-        # 由于init时已经处理了过期文件，这里只需要检查域名是否在缓存中
-        if domain in self.dns_records:
+        try:
+            # shield 防止某个调用方被取消时连带取消共享的解析任务
+            ips = await asyncio.shield(future)
+        except Exception:
+            # 解析出错的结果不缓存，下次调用重新解析
+            if self._inflight.get(domain) is future:
+                del self._inflight[domain]
+            raise
+        return set(ips)
+
+    async def _resolve_domain(self, domain: str) -> Set[str]:
+        async with self._resolve_sem:
             domain_hosts = self.dns_records.get(domain, {})
-            ipv4_ips = domain_hosts.get("ipv4", [])
-            ipv6_ips = domain_hosts.get("ipv6", [])
+            now = time.time()
+
+            # 0. 命中否定缓存时直接返回，避免重复的失败查询
+            if self._is_unexpired(domain_hosts.get("negative_until"), now):
+                logging.debug(f"{domain} 命中否定缓存，跳过解析")
+                return set()
+
+            # 1. 缓存记录未过期时直接使用，无需任何网络请求
+            if self._is_unexpired(domain_hosts.get("expires_at"), now):
+                ips = set(domain_hosts.get("ipv4", []) + domain_hosts.get("ipv6", []))
+                logging.debug(f"{domain} 命中 DNS 缓存, 发现 {len(ips)} 个 DNS 主机")
+                return ips
+
+            ips = set()
+
+            # 2. 通过常规DNS服务器解析
+            dns_ips, ttl, timed_out = await self._resolve_via_dns(domain)
+            ips.update(dns_ips)
+
+            # 3. 通过DNS_records(ipaddress.com)解析，结果单独缓存，
+            #    有效期内只重新查询 DNS，避免每次运行都请求 ipaddress.com
+            ipaddress_expires_at = domain_hosts.get("ipaddress_expires_at")
+            if self._is_unexpired(ipaddress_expires_at, now):
+                ipaddress_ips = set(domain_hosts.get("ipaddress_ips", []))
+                logging.debug(f"{domain} 命中 DNS_records 缓存")
+            else:
+                try:
+                    ipaddress_ips = await self._resolve_via_ipaddress(domain)
+                except Exception as e:
+                    logging.error(f"通过DNS_records解析 {domain} 失败: {e}")
+                    ipaddress_ips = None
 
-            ips.update(ipv4_ips + ipv6_ips)
-        else:
-            ipaddress_ips = await self._resolve_via_ipaddress(domain)
+                if ipaddress_ips is not None:
+                    ipaddress_expires_at = time.time() + IPADDRESS_CACHE_TTL
+                else:
+                    # 失败也记录一段较短的时间，避免之后每次运行都重复等待超时
+                    ipaddress_ips = set()
+                    ipaddress_expires_at = time.time() + IPADDRESS_FAILURE_TTL
+                    # 重试后仍失败多为临时故障，使用较短的否定缓存时间
+                    timed_out = True
             ips.update(ipaddress_ips)
 
+            if ips:
+                logging.debug(f"成功解析 {domain}, 发现 {len(ips)} 个 DNS 主机")
+                self._cache_positive(
+                    domain, ips, ttl, ipaddress_ips, ipaddress_expires_at
+                )
+            else:
+                logging.debug(f"警告: 无法解析 {domain}")
+                self._cache_negative(domain, timed_out)
+
+            return ips
+
+    @staticmethod
+    def _is_unexpired(expires_at, now: float) -> bool:
+        """缓存时间戳为 Unix 时间（秒），旧版缓存中的 ISO 时间字符串一律视为过期"""
+        return isinstance(expires_at, (int, float)) and expires_at > now
+
+    def _cache_positive(
+        self,
+        domain: str,
+        ips: Set[str],
+        ttl: Optional[int],
+        ipaddress_ips: Set[str],
+        ipaddress_expires_at: Optional[float],
+    ):
+        """缓存解析结果，有效期取 DNS 记录的 TTL，缺失时使用默认值
+
+        ipaddress.com 的结果另行记录并使用自身的有效期
+        """
+        if ttl is None:
+            ttl = DNS_CACHE_DEFAULT_TTL
+        ttl = max(ttl, DNS_CACHE_MIN_TTL)
+        record = {
+            "last_update": datetime.now().isoformat(),
+            "expires_at": time.time() + ttl,
+            "ipv4": [ip for ip in ips if not Utils.is_ipv6(ip)],
+            "ipv6": [ip for ip in ips if Utils.is_ipv6(ip)],
+        }
+        if ipaddress_expires_at is not None:
+            record["ipaddress_ips"] = list(ipaddress_ips)
+            record["ipaddress_expires_at"] = ipaddress_expires_at
+        self.dns_records[domain] = record
+        self._schedule_cache_save()
+
+    def _cache_negative(self, domain: str, timed_out: bool):
+        """记录无解析结果的域名，超时使用更短的缓存时间"""
+        ttl = TIMEOUT_CACHE_TTL if timed_out else NEGATIVE_CACHE_TTL
+        self.dns_records[domain] = {
+            "last_update": datetime.now().isoformat(),
+            "negative_until": time.time() + ttl,
+        }
+        self._schedule_cache_save()
+
+    def _pick_dns_servers(self) -> List[str]:
+        """随机打乱 DNS 服务器顺序以分摊查询压力，连续故障的服务器排在最后"""
+        dns_servers = random.sample(self.dns_servers, len(self.dns_servers))
+        healthy = [
+            dns_server
+            for dns_server in dns_servers
+            if self._server_failures[dns_server] < DNS_SERVER_MAX_FAILURES
+        ]
+        unhealthy = [
+            dns_server for dns_server in dns_servers if dns_server not in healthy
+        ]
+        return healthy + unhealthy
+
+    async def _resolve_via_dns(
+        self, domain: str
+    ) -> Tuple[Set[str], Optional[int], bool]:
+        """返回解析到的 IP 集合、记录的最小 TTL，以及是否有查询因超时失败"""
+        dns_servers = self._pick_dns_servers()
+        selected = dns_servers[:DNS_SERVERS_PER_QUERY]
+        remaining = dns_servers[DNS_SERVERS_PER_QUERY:]
+        ips = set()
+        ttl = None
+        timed_out = False
+
+        # 每个服务器单独查询，任一服务器返回 IP 即采用；
+        # 选中的服务器超过 DNS_HEDGE_DELAY 未返回或均无结果时，再查询其余服务器
+        loop = asyncio.get_running_loop()
+        hedge_at = loop.time() + DNS_HEDGE_DELAY
+        pending = {
+            asyncio.ensure_future(self._query_server(dns_server, domain))
+            for dns_server in selected
+        }
+        try:
+            while pending:
+                timeout = max(hedge_at - loop.time(), 0) if remaining else None
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    task_ips, task_ttl, task_timed_out = task.result()
+                    ips.update(task_ips)
+                    timed_out = timed_out or task_timed_out
+                    if task_ttl is not None:
+                        ttl = task_ttl if ttl is None else min(ttl, task_ttl)
+                if ips:
+                    break
+                if remaining and (not pending or loop.time() >= hedge_at):
+                    pending.update(
+                        asyncio.ensure_future(self._query_server(dns_server, domain))
+                        for dns_server in remaining
+                    )
+                    remaining = []
+        finally:
+            # 未完成的查询不取消，留在后台结束，保证慢速或故障服务器的熔断计数被记录
+            for task in pending:
+                self._background_queries.add(task)
+                task.add_done_callback(self._background_queries.discard)
+
         if ips:
-            logging.debug(f"成功解析 {domain}, 发现 {len(ips)} 个 DNS 主机")
-        else:
-            logging.debug(f"警告: 无法解析 {domain}")
+            logging.debug(f"成功解析 {domain}")
+            logging.debug(f"DNS_resolver：\n {ips}")
 
-        return ips
+        return ips, ttl, timed_out
 
-    async def _resolve_via_dns(self, domain: str) -> Set[str]:
+    async def _query_server(
+        self, dns_server: str, domain: str
+    ) -> Tuple[Set[str], Optional[int], bool]:
+        """同时向单个 DNS 服务器发起 A 与 AAAA 查询，并更新该服务器的熔断计数"""
         ips = set()
-        for dns_server in self.dns_servers:
-            try:
-                resolver = dns.resolver.Resolver()
-                resolver.nameservers = [dns_server]
-                resolver.lifetime = RESOLVER_TIMEOUT
+        ttl = None
+        timed_out = False
+        qtypes = ("A", "AAAA")
+        results = await asyncio.gather(
+            *(self._query(dns_server, domain, qtype) for qtype in qtypes),
+            return_exceptions=True,
+        )
 
-                for qtype in ["A", "AAAA"]:
-                    try:
-                        answers = await asyncio.to_thread(
-                            resolver.resolve, domain, qtype
-                        )
-                        ips.update(answer.address for answer in answers)
-                    except dns.resolver.NoAnswer:
-                        pass
+        for qtype, result in zip(qtypes, results):
+            if isinstance(result, Exception):
+                # 超时或连接被拒绝属于服务器故障，不代表域名不存在
+                if isinstance(result, (asyncio.TimeoutError, ConnectionError)):
+                    timed_out = True
+                logging.debug(
+                    f"使用 {dns_server} 解析 {domain} 的 {qtype} 记录失败: {result}"
+                )
+                continue
+            answer_ips, answer_ttl = result
+            ips.update(answer_ips)
+            if answer_ttl is not None:
+                ttl = answer_ttl if ttl is None else min(ttl, answer_ttl)
+
+        # 更新熔断计数：故障则累加，正常响应则清零
+        if timed_out:
+            self._server_failures[dns_server] += 1
+        else:
+            self._server_failures[dns_server] = 0
 
-                if ips:
-                    logging.debug(f"成功使用 {dns_server} 解析 {domain}")
-                    logging.debug(f"DNS_resolver：\n {ips}")
-                    return ips
-            except Exception as e:
-                logging.debug(f"使用 {dns_server} 解析 {domain} 失败: {e}")
+        return ips, ttl, timed_out
 
-        return ips
+    def retry_async(tries=3, max_delay=RETRY_MAX_DELAY, timeout_tries=2):
+        """异步重试装饰器，仅对超时、连接错误与 429/5xx 等临时错误进行指数退避重试
+
+        超时最多尝试 timeout_tries 次，避免服务无响应时每次请求都耗尽全部重试
+        """
+
+        def is_transient(e: Exception) -> bool:
+            if isinstance(e, aiohttp.ClientResponseError):
+                return e.status in RETRY_STATUS_CODES
+            return isinstance(e, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
 
-    def retry_async(tries=3, delay=0):
         def decorator(func):
             @wraps(func)
             async def wrapper(*args, **kwargs):
+                timeouts = 0
                 for attempt in range(tries):
                     try:
                         return await func(*args, **kwargs)
                     except Exception as e:
-                        if attempt == tries - 1:
+                        if isinstance(e, asyncio.TimeoutError):
+                            timeouts += 1
+                        if (
+                            attempt == tries - 1
+                            or not is_transient(e)
+                            or timeouts >= timeout_tries
+                        ):
                             raise e
+                        # 指数退避并加入随机抖动，避免重试请求集中触发限流
+                        delay = min(2**attempt, max_delay) + random.random()
+                        logging.debug(
+                            f"{func.__name__} 第 {attempt + 1} 次请求失败: {e}，"
+                            f"{delay:.2f} 秒后重试"
+                        )
                         await asyncio.sleep(delay)
                 return None
 
@@ -348,8 +749,30 @@ class DomainResolver:
 
         return decorator
 
+    def _defer_ipaddress_requests(self, retry_after: Optional[str]):
+        """收到 429 时按 Retry-After 推迟后续所有 ipaddress.com 请求"""
+        try:
+            delay = min(float(retry_after), RETRY_MAX_DELAY)
+        except (TypeError, ValueError):
+            return
+        next_request = asyncio.get_running_loop().time() + delay
+        self._ipaddress_last = max(
+            self._ipaddress_last, next_request - IPADDRESS_INTERVAL
+        )
+
+    async def _wait_ipaddress_interval(self):
+        """等待到下一个可用的请求时间点，避免触发 ipaddress.com 的限流"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # 先占用下一个时间点再等待，并发的请求会依次顺延
+        scheduled = max(now, self._ipaddress_last + IPADDRESS_INTERVAL)
+        self._ipaddress_last = scheduled
+        if scheduled > now:
+            await asyncio.sleep(scheduled - now)
+
     @retry_async(tries=3)
-    async def _resolve_via_ipaddress(self, domain: str) -> Set[str]:
+    async def _resolve_via_ipaddress(self, domain: str) -> Optional[Set[str]]:
+        """从 ipaddress.com 查询域名的 IP，ipaddress.com 连续超时被跳过时返回 None"""
         ips = set()
         url = f"https://sites.ipaddress.com/{domain}"
         headers = {
@@ -358,49 +781,51 @@ class DomainResolver:
             "Chrome/106.0.0.0 Safari/537.36"
         }
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, timeout=5) as response:
-                    if response.status != 200:
-                        logging.info(
-                            f"DNS_records(ipaddress.com) 查询请求失败: {response.status}"
-                        )
-                        return ips
-
-                    content = await response.text()
-                    # 匹配IPv4地址
-                    ipv4_pattern = r"\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b"
-                    ipv4_ips = set(re.findall(ipv4_pattern, content))
-
-                    # 匹配IPv6地址
-                    ipv6_pattern = r"(?:[0-9a-fA-F]{1,4}:){7}[0-9a-fA-F]{1,4}"
-                    ipv6_ips = set(re.findall(ipv6_pattern, content))
-
-                    ips.update(ipv4_ips)
-                    ips.update(ipv6_ips)
-
-                    if ips:
-                        # 更新hosts缓存
-                        current_time = datetime.now().isoformat()
-                        self.dns_records[domain] = {
-                            "last_update": current_time,
-                            "ipv4": list(ipv4_ips),
-                            "ipv6": list(ipv6_ips),
-                            "source": "DNS_records",
-                        }
-                        # 保存到文件
-                        self.save_hosts_cache()
-                        logging.debug(
-                            f"通过 ipaddress.com 成功解析 {domain} 并更新 DNS_records 缓存"
-                        )
-                        logging.debug(f"DNS_records：\n {ips}")
-                    else:
-                        logging.debug(
-                            f"ipaddress.com 未解析到 {domain} 的 DNS_records 地址"
+        async with self._ipaddress_sem:
+            # 排队期间 ipaddress.com 已被判定为不可用时不再发起请求
+            if self._ipaddress_timeouts >= IPADDRESS_MAX_TIMEOUTS:
+                logging.debug(f"ipaddress.com 连续超时，跳过 {domain}")
+                return None
+            await self._wait_ipaddress_interval()
+            session = await self._get_session()
+            try:
+                response = await session.get(url, headers=headers, timeout=5)
+            except asyncio.TimeoutError:
+                self._ipaddress_timeouts += 1
+                raise
+            self._ipaddress_timeouts = 0
+
+            async with response:
+                if response.status in RETRY_STATUS_CODES:
+                    if response.status == 429:
+                        self._defer_ipaddress_requests(
+                            response.headers.get("Retry-After")
                         )
+                    # 抛出 ClientResponseError，由 retry_async 退避重试
+                    response.raise_for_status()
 
-        except Exception as e:
-            logging.error(f"通过DNS_records解析 {domain} 失败: {e}")
+                if response.status != 200:
+                    # 400/403/404 等错误重试无意义，直接返回空结果
+                    logging.info(
+                        f"DNS_records(ipaddress.com) 查询请求失败: {response.status}"
+                    )
+                    return ips
+
+                content = await response.text()
+                # 匹配IPv4/IPv6地址，剔除 999.1.1.1 之类的无效匹配与非公网地址
+                ips.update(
+                    ip
+                    for ip in set(IP_PATTERN.findall(content))
+                    if Utils.is_routable_ip(ip)
+                )
+
+                if ips:
+                    logging.debug(f"通过 ipaddress.com 成功解析 {domain}")
+                    logging.debug(f"DNS_records：\n {ips}")
+                else:
+                    logging.debug(
+                        f"ipaddress.com 未解析到 {domain} 的 DNS_records 地址"
+                    )
 
         return ips
 
@@ -414,47 +839,108 @@ class LatencyTester:
         self.hosts_num = hosts_num
         self.progress = None
         self.current_task = None
+        # 无 IPv6 路由时跳过 IPv6 地址的延迟测试
+        self.ipv6_ok = Utils.has_ipv6_route()
+        # 所有组共用，限制同时打开的测试连接数量
+        self._probe_sem = asyncio.Semaphore(MAX_CONCURRENT_PROBES)
+        # 仅在指定 --icmp 且安装了 icmplib 时启用，首次遇到权限问题后关闭
+        self.use_icmp = args.icmp and icmplib is not None
+        if args.icmp and icmplib is None:
+            logging.warning("未安装 icmplib，使用 TCP 连接测试延迟")
 
     def set_progress(self, progress, task):
         """设置进度显示器和当前任务"""
         self.progress = progress
         self.current_task = task
 
-    async def get_latency(self, ip: str, port: int = 443) -> float:
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _resolve_sockaddr(ip: str, port: int = 443) -> tuple:
+        """获取 IP 对应的连接地址，IP 字面量直接构造，其余情况调用 getaddrinfo"""
         try:
-            # 使用 getaddrinfo 来获取正确的地址格式
-            addrinfo = await asyncio.get_event_loop().getaddrinfo(
-                ip, port, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM
-            )
+            socket.inet_pton(socket.AF_INET, ip)
+            return (ip, port)
+        except OSError:
+            pass
+        try:
+            socket.inet_pton(socket.AF_INET6, ip)
+            return (ip, port, 0, 0)
+        except OSError:
+            pass
+
+        # 非 IP 字面量（正常情况下不会出现）才需要解析
+        addrinfo = socket.getaddrinfo(
+            ip, port, family=socket.AF_UNSPEC, type=socket.SOCK_STREAM
+        )
+        return addrinfo[0][4]
 
-            for family, type, proto, canonname, sockaddr in addrinfo:
-                try:
-                    start = asyncio.get_event_loop().time()
-                    _, writer = await asyncio.wait_for(
-                        asyncio.open_connection(sockaddr[0], sockaddr[1]),
-                        timeout=PING_TIMEOUT,
+    async def _measure_once(self, sockaddr: tuple) -> float:
+        """对已解析的地址进行一次 TCP 连接测试，返回毫秒延迟"""
+        loop = asyncio.get_running_loop()
+        # IPv6 的 sockaddr 为四元组
+        family = socket.AF_INET6 if len(sockaddr) == 4 else socket.AF_INET
+        try:
+            async with self._probe_sem:
+                # 直接使用非阻塞套接字，连接建立即关闭，无需创建 transport 与读写流
+                # 计时使用 perf_counter，uvloop 的 loop.time() 只精确到毫秒
+                with socket.socket(family, socket.SOCK_STREAM) as sock:
+                    sock.setblocking(False)
+                    start = time.perf_counter()
+                    await asyncio.wait_for(
+                        loop.sock_connect(sock, sockaddr), timeout=PING_TIMEOUT
                     )
-                    end = asyncio.get_event_loop().time()
-                    writer.close()
-                    await writer.wait_closed()
-                    return (end - start) * 1000
-                except asyncio.TimeoutError:
-                    continue
-                except Exception as e:
-                    logging.debug(f"连接测试失败 {ip} (sockaddr: {sockaddr}): {e}")
-                    continue
+                    end = time.perf_counter()
+            return (end - start) * 1000
+        except asyncio.TimeoutError:
+            return float("inf")
+        except Exception as e:
+            logging.debug(f"连接测试失败 (sockaddr: {sockaddr}): {e}")
+            return float("inf")
 
+    def _disable_icmp(self, e: Exception):
+        """ICMP 套接字不可用（如 Linux 非 root 用户）时改用 TCP 连接测试"""
+        if self.use_icmp:
+            self.use_icmp = False
+            logging.warning(f"ICMP ping 不可用，改用 TCP 连接测试延迟: {e}")
+
+    async def _icmp_latency(self, ip: str) -> Optional[float]:
+        """ICMP ping 一次，返回毫秒延迟；ICMP 不可用时返回 None"""
+        try:
+            async with self._probe_sem:
+                host = await icmplib.async_ping(
+                    ip,
+                    count=1,
+                    timeout=PING_TIMEOUT,
+                    privileged=PrivilegeManager.is_admin(),
+                )
+        except (icmplib.SocketPermissionError, icmplib.SocketUnavailableError) as e:
+            self._disable_icmp(e)
+            return None
+        except icmplib.ICMPLibError as e:
+            logging.debug(f"ICMP ping 失败 {ip}: {e}")
             return float("inf")
+        return host.avg_rtt if host.is_alive else float("inf")
+
+    async def get_latency(self, ip: str, port: int = 443) -> float:
+        if self.use_icmp:
+            latency = await self._icmp_latency(ip)
+            if latency is not None:
+                return latency
+        try:
+            sockaddr = self._resolve_sockaddr(ip, port)
         except Exception as e:
             logging.error(f"获取地址信息失败 {ip}: {e}")
             return float("inf")
+        return await self._measure_once(sockaddr)
 
     async def get_host_average_latency(
         self, ip: str, port: int = 443
     ) -> Tuple[str, float]:
         try:
+            # 地址只解析一次，多次 ping 复用同一个 sockaddr
+            sockaddr = self._resolve_sockaddr(ip, port)
             response_times = await asyncio.gather(
-                *[self.get_latency(ip, port) for _ in range(NUM_PINGS)]
+                *[self._measure_once(sockaddr) for _ in range(NUM_PINGS)]
             )
             response_times = [t for t in response_times if t != float("inf")]
             if response_times:
@@ -466,24 +952,62 @@ class LatencyTester:
                 logging.error(f"{ip} 平均延迟为 0 ms，视为无效")
                 return ip, float("inf")
 
-            if self.progress and self.current_task:
-                self.progress.update(self.current_task, advance=1)
-
             logging.debug(f"{ip} 平均延迟: {average_response_time:.2f} ms")
             return ip, average_response_time
         except Exception as e:
             logging.debug(f"ping {ip} 时出错: {e}")
             return ip, float("inf")
 
+    async def get_hosts_average_latency(
+        self, ips: List[str]
+    ) -> List[Tuple[str, float]]:
+        """批量测试多个IP的平均延迟，启用 ICMP 时一次 multiping 完成"""
+        if self.use_icmp and ips:
+            try:
+                hosts = await icmplib.async_multiping(
+                    ips,
+                    count=NUM_PINGS,
+                    interval=0.2,
+                    timeout=PING_TIMEOUT,
+                    concurrent_tasks=ICMP_CONCURRENCY,
+                    privileged=PrivilegeManager.is_admin(),
+                )
+                return [
+                    (host.address, host.avg_rtt if host.is_alive else float("inf"))
+                    for host in hosts
+                ]
+            except (
+                icmplib.SocketPermissionError,
+                icmplib.SocketUnavailableError,
+            ) as e:
+                self._disable_icmp(e)
+        return await asyncio.gather(*(self.get_host_average_latency(ip) for ip in ips))
+
+    async def _probe_latency(self, ip: str) -> Tuple[str, float]:
+        """单次延迟测试，用于快速筛选候选IP"""
+        return ip, await self.get_latency(ip)
+
+    def _is_probeable(self, ip: str) -> bool:
+        """可路由且本机可达的地址族才进行延迟测试"""
+        return Utils.is_routable_ip(ip) and (self.ipv6_ok or not Utils.is_ipv6(ip))
+
+    def start_probes(self, ips: Set[str], probe_tasks: Dict[str, asyncio.Task]):
+        """为尚未测试的IP立即启动单次延迟测试，使延迟测试与域名解析重叠进行"""
+        for ip in ips:
+            if ip not in probe_tasks and self._is_probeable(ip):
+                probe_tasks[ip] = asyncio.create_task(self._probe_latency(ip))
+
     async def get_lowest_latency_hosts(
         self,
         group_name: str,
         domains: List[str],
         file_ips: Set[str],
         latency_limit: int,
-        latency_task_id: TaskID,
+        latency_task_id: Optional[TaskID],
+        probe_tasks: Optional[Dict[str, asyncio.Task]] = None,
     ) -> List[Tuple[str, float]]:
-        all_ips = file_ips
+        # 剔除回环、私有及本机无路由的 IPv6 等必然超时的地址，避免无效的延迟测试
+        all_ips = {ip for ip in file_ips if self._is_probeable(ip)}
         total_ips = len(all_ips)
 
         # 更新进度条描述和总数
@@ -498,14 +1022,18 @@ class LatencyTester:
                 f"[bright_black]- 解析到 [bold bright_green]{len(all_ips):2}[/bold bright_green] 个唯一IP地址 [{group_name}][/bright_black]"
             )
 
-        # Ping所有IP
-        ping_tasks = [self.get_host_average_latency(ip) for ip in all_ips]
+        # 1. 快速筛选：每个IP只 ping 一次，凑齐足够的合格IP后取消其余测试
+        has_ipv6 = any(Utils.is_ipv6(ip) for ip in all_ips)
+        # 复用解析阶段已提前启动的测试任务，其余IP在此补齐
+        probe_tasks = dict(probe_tasks or {})
+        self.start_probes(all_ips, probe_tasks)
+        probe_results = []
+        qualified_ipv4 = qualified_ipv6 = 0
 
-        results = []
-        # 使用 asyncio.as_completed 确保每个任务完成时立即处理
-        for coro in asyncio.as_completed(ping_tasks):
-            result = await coro
-            results.append(result)
+        def enough_qualified(ip: str, latency: float) -> bool:
+            """记录一个测试结果，返回合格IP是否已经足够"""
+            nonlocal qualified_ipv4, qualified_ipv6
+            probe_results.append((ip, latency))
 
             # 每完成一个任务立即更新进度
             if self.progress and latency_task_id:
@@ -516,6 +1044,43 @@ class LatencyTester:
                     total=total_ips,
                 )
 
+            if latency < latency_limit:
+                if Utils.is_ipv6(ip):
+                    qualified_ipv6 += 1
+                else:
+                    qualified_ipv4 += 1
+
+            # 有 IPv6 时各需 1 个，否则需 hosts_num 个 IPv4
+            if has_ipv6:
+                return qualified_ipv4 >= 1 and qualified_ipv6 >= 1
+            return qualified_ipv4 >= self.hosts_num
+
+        try:
+            # 解析期间已完成的测试全部收下并按延迟排序，不能按完成顺序提前结束，
+            # 否则会漏掉已测得的更快IP
+            finished = [task for task in probe_tasks.values() if task.done()]
+            pending = [task for task in probe_tasks.values() if not task.done()]
+            enough = False
+            for ip, latency in sorted(
+                (task.result() for task in finished), key=itemgetter(1)
+            ):
+                enough = enough_qualified(ip, latency)
+
+            # 尚未完成的测试按完成先后处理，凑齐足够的合格IP后取消其余测试
+            if not enough:
+                for coro in asyncio.as_completed(pending):
+                    if enough_qualified(*await coro):
+                        break
+        finally:
+            for task in probe_tasks.values():
+                task.cancel()
+
+        # 2. 仅对通过筛选的IP（含放宽限制的候选）进行多次 ping 取平均值
+        candidates = [
+            ip for ip, latency in probe_results if latency < latency_limit * 2
+        ]
+        results = await self.get_hosts_average_latency(candidates)
+
         if self.progress and latency_task_id:
             # 确保进度完结
             self.progress.update(
@@ -537,26 +1102,34 @@ class LatencyTester:
             if not valid_results:
                 return []
 
-        ipv4_results = [r for r in valid_results if not Utils.is_ipv6(r[0])]
-        ipv6_results = [r for r in valid_results if Utils.is_ipv6(r[0])]
+        # 一次遍历按地址族拆分，只取所需的前几名而不对全部结果排序
+        ipv4_results, ipv6_results = [], []
+        for result in valid_results:
+            if Utils.is_ipv6(result[0]):
+                ipv6_results.append(result)
+            else:
+                ipv4_results.append(result)
 
-        best_hosts = []
+        by_latency = itemgetter(1)
         if ipv4_results and ipv6_results:
-            best_hosts.append(min(ipv4_results, key=lambda x: x[1]))
-            best_hosts.append(min(ipv6_results, key=lambda x: x[1]))
+            best_hosts = [
+                min(ipv4_results, key=by_latency),
+                min(ipv6_results, key=by_latency),
+            ]
         else:
-            best_hosts = sorted(valid_results, key=lambda x: x[1])[: self.hosts_num]
+            best_hosts = heapq.nsmallest(self.hosts_num, valid_results, key=by_latency)
 
         if args.verbose:
-            rprint(
+            # 标题与各主机合并为一次输出，减少多个分组并发打印时的渲染次数
+            lines = [
                 f"[bold yellow]最快DNS主机 {'(IPv4/IPv6)' if ipv6_results else '(IPv4 Only)'} 延迟 < {latency_limit}ms | [{group_name}] "
                 f"{domains[0] if len(domains) == 1 else f'{len(domains)} 域名合用 IP'}:[/bold yellow]"
+            ]
+            lines.extend(
+                f"  [green]{ip}[/green]    [bright_black]{latency:.2f} ms[/bright_black]"
+                for ip, latency in best_hosts
             )
-
-            for ip, time in best_hosts:
-                rprint(
-                    f"  [green]{ip}[/green]    [bright_black]{time:.2f} ms[/bright_black]"
-                )
+            rprint("\n".join(lines))
         return best_hosts
 
 
@@ -575,47 +1148,15 @@ class HostsManager:
     def write_to_hosts_file(self, new_entries: List[str]):
         Utils.backup_hosts_file(self.hosts_file_path)
 
-        with open(self.hosts_file_path, "r") as f:
-            existing_content = f.read().splitlines()
-
-        new_domains = {
-            entry.split()[1] for entry in new_entries if len(entry.split()) >= 2
-        }
-
-        new_content = []
-        skip = False
-        skip_tags = ("# cnNetTool", "# Update", "# Star", "# GitHub")
-
-        for line in existing_content:
-            line = line.strip()
-
-            # 跳过标记块
-            if any(line.startswith(tag) for tag in skip_tags):
-                skip = True
-
-            if line == "":
-                skip = True
-
-            if skip:
-                if line == "" or line.startswith("#"):
-                    continue
-                skip = False
-
-            # 非标记块内容保留
-            if (
-                not skip
-                and (line.startswith("#") or not line)
-                and not any(tag in line for tag in skip_tags)
-            ):
-                new_content.append(line)
-                continue
-
-            # 检查域名是否为新条目
-            parts = line.split()
-            if len(parts) >= 2 and parts[1] not in new_domains:
-                new_content.append(line)
-            else:
-                logging.debug(f"删除旧条目: {line}")
+        # 拆分 IP 与域名，并去除重复的 (IP, 域名) 条目
+        parsed_entries = list(
+            dict.fromkeys(
+                tuple(parts)
+                for parts in (entry.split(maxsplit=1) for entry in new_entries)
+                if len(parts) == 2
+            )
+        )
+        new_domains = {domain for _, domain in parsed_entries}
 
         update_time = (
             datetime.now(timezone.utc)
@@ -629,41 +1170,17 @@ class HostsManager:
         save_hosts_content = []  # 提取新内容文本
 
         # 1. 添加标题
-        new_content.append(f"\n# cnNetTool Start in {update_time}")
         save_hosts_content.append(f"\n# cnNetTool Start in {update_time}")
 
-        # 2. 添加主机条目
-        for entry in new_entries:
-            # 分割 IP 和域名
-            ip, domain = entry.strip().split(maxsplit=1)
-
-            # 计算需要的制表符数量
-            # IP 地址最长可能是 39 个字符 (IPv6)
-            # 我们使用制表符(8个空格)来对齐，确保视觉上的整齐
-            ip_length = len(ip)
-            if ip_length <= 8:
-                tabs = "\t\t\t"  # 两个制表符
-            if ip_length <= 10:
-                tabs = "\t\t"  # 两个制表符
-            elif ip_length <= 16:
-                tabs = "\t"  # 一个制表符
-            else:
-                tabs = "\t"  # 对于很长的IP，只使用一个空格
-
-            # 返回格式化后的条目
-            formatedEntry = f"{ip}{tabs}{domain}"
-            new_content.append(formatedEntry)
-            save_hosts_content.append(formatedEntry)
-            rprint(f"+ {formatedEntry}")
+        # 2. 添加主机条目，按最长的 IP 统一对齐域名列
+        width = max((len(ip) for ip, _ in parsed_entries), default=0) + 2
+        new_lines = [f"{ip:<{width}}{domain}" for ip, domain in parsed_entries]
+        save_hosts_content.extend(new_lines)
+        # 全部条目一次性输出，避免逐行解析样式标记与刷新终端
+        if new_lines:
+            rprint("\n".join(f"+ {line}" for line in new_lines))
 
         # 3. 添加项目描述
-        new_content.extend(
-            [
-                f"\n# Update time: {update_time}",
-                "# GitHub仓库: https://github.com/sinspired/cnNetTool",
-                "# cnNetTool End\n",
-            ]
-        )
         save_hosts_content.extend(
             [
                 f"\n# Update time: {update_time}",
@@ -672,13 +1189,29 @@ class HostsManager:
             ]
         )
 
-        # 4. 写入hosts文件
-        with open(self.hosts_file_path, "w") as f:
-            f.write("\n".join(new_content))
+        save_hosts_text = "\n".join(save_hosts_content)
+
+        # 4. 逐行读取原 hosts 文件，保留的内容与新条目写入临时文件后原子替换
+        temp_file_path = f"{self.hosts_file_path}.new"
+        try:
+            with open(self.hosts_file_path, "r") as src, open(
+                temp_file_path, "w", buffering=1 << 16
+            ) as dst:
+                self._copy_retained_lines(src, dst, new_domains)
+                dst.write(save_hosts_text)
+                # 替换前确保内容已落盘，避免断电后出现空的 hosts 文件
+                dst.flush()
+                os.fsync(dst.fileno())
+            self._replace_hosts_file(temp_file_path)
+        except BaseException:
+            # 写入或替换失败时删除临时文件，避免在 hosts 所在目录残留 .new 文件
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
 
         # 保存 hosts 文本
         with open("hosts", "w") as f:
-            f.write("\n".join(save_hosts_content))
+            f.write(save_hosts_text)
             rprint(
                 f"\n[blue]已生成 hosts 文件,位于: [underline]hosts[/underline][/blue]"
             )
@@ -689,6 +1222,52 @@ class HostsManager:
                 save_hosts_content, "README_template.md", f"{update_time}"
             )
 
+    @staticmethod
+    def _copy_retained_lines(src, dst, new_domains: Set[str]):
+        """逐行复制原 hosts 文件中需要保留的内容，去掉本工具的标记块与将被更新的条目"""
+        in_managed_block = False
+        # 空行延迟写入，文件末尾的空行直接丢弃，避免每次更新累积空行
+        pending_blank_lines = 0
+
+        for line in src:
+            line = line.strip()
+
+            # 标记行：Start/End 切换标记块状态，标记行本身不保留
+            tag = HOSTS_TAG_PATTERN.match(line)
+            if tag:
+                in_managed_block = tag.group(1) == "Start"
+                continue
+
+            if not line or line.startswith("#"):
+                # 标记块内的空行与注释（Update time、GitHub仓库）由本工具生成，
+                # 块外的原样保留
+                if in_managed_block:
+                    continue
+                if not line:
+                    pending_blank_lines += 1
+                    continue
+            else:
+                # 检查域名是否为新条目
+                parts = line.split()
+                if len(parts) < 2 or parts[1] in new_domains:
+                    logging.debug(f"删除旧条目: {line}")
+                    continue
+
+            dst.write("\n" * pending_blank_lines)
+            pending_blank_lines = 0
+            dst.write(f"{line}\n")
+
+    def _replace_hosts_file(self, temp_file_path: str):
+        """用临时文件替换 hosts 文件，避免写入中途出错导致文件损坏"""
+        shutil.copymode(self.hosts_file_path, temp_file_path)
+        try:
+            os.replace(temp_file_path, self.hosts_file_path)
+        except OSError as e:
+            # hosts 文件为挂载点等无法替换的情况，退回直接覆盖写入
+            logging.debug(f"原子替换 hosts 文件失败，改为直接写入: {e}")
+            shutil.copyfile(temp_file_path, self.hosts_file_path)
+            os.remove(temp_file_path)
+
 
 # -------------------- 主控制模块 -------------------- #
 class HostsUpdater:
@@ -703,8 +1282,6 @@ class HostsUpdater:
         self.resolver = resolver
         self.tester = tester
         self.hosts_manager = hosts_manager
-        # 添加并发限制
-        self.semaphore = asyncio.Semaphore(200)  # 限制并发请求数
 
         # 添加进度显示实例
         self.progress = Progress(
@@ -715,10 +1292,12 @@ class HostsUpdater:
         )
 
     async def _resolve_domains_batch(
-        self, domains: List[str], resolve_task_id: TaskID
+        self,
+        domains: List[str],
+        resolve_task_id: TaskID,
+        probe_tasks: Optional[Dict[str, asyncio.Task]] = None,
     ) -> Dict[str, Set[str]]:
-        """批量解析域名，带进度更新"""
-        results = {}
+        """批量解析域名，带进度更新；传入 probe_tasks 时边解析边测试延迟"""
         total_domains = len(domains)
 
         # 更新进度条描述和总数
@@ -728,21 +1307,14 @@ class HostsUpdater:
                 total=total_domains,
             )
 
-        async with self.semaphore:
-            for i, domain in enumerate(domains, 1):
-                try:
-                    ips = await self.resolver.resolve_domain(domain)
-                    results[domain] = ips
-                except Exception as e:
-                    logging.error(f"解析域名 {domain} 失败: {e}")
-                    results[domain] = set()
-
-                # 更新进度
-                self.progress.update(
-                    resolve_task_id,
-                    advance=1,
-                    visible=True,
-                )
+        # 并发解析，并发数量由 DomainResolver 的信号量限制
+        resolved = await asyncio.gather(
+            *(
+                self._resolve_domain(domain, resolve_task_id, probe_tasks)
+                for domain in domains
+            )
+        )
+        results = dict(zip(domains, resolved))
 
         if self.progress and resolve_task_id:
             # 确保进度完结
@@ -753,10 +1325,72 @@ class HostsUpdater:
             )
         return results
 
+    async def _resolve_domain(
+        self,
+        domain: str,
+        resolve_task_id: TaskID,
+        probe_tasks: Optional[Dict[str, asyncio.Task]] = None,
+    ) -> Set[str]:
+        """解析单个域名，完成后更新进度"""
+        try:
+            ips = await self.resolver.resolve_domain(domain)
+        except Exception as e:
+            logging.error(f"解析域名 {domain} 失败: {e}")
+            ips = set()
+
+        if probe_tasks is not None:
+            self.tester.start_probes(ips, probe_tasks)
+
+        # 更新进度
+        self.progress.update(
+            resolve_task_id,
+            advance=1,
+            visible=True,
+        )
+        return ips
+
+    async def _process_separate_domain(
+        self, group_name: str, domain: str, domain_ips: Set[str], group_task_id: TaskID
+    ) -> List[str]:
+        """测试独立主机域名的延迟，多个域名并发测试时各自使用独立的延迟进度条"""
+        entries = []
+        if not domain_ips:
+            logging.warning(f"{domain} 未解析到任何可用IP。跳过该域名。")
+        else:
+            # 为该域名设置 [测试延迟] 子任务进度显示，避免并发测试时共用进度条
+            latency_task_id = self.progress.add_task(
+                f"- [测试延迟] {domain}",
+                total=0,  # 初始设为0，后续会更新
+                visible=False,  # 初始隐藏，等需要时显示
+            )
+            try:
+                fastest_ips = await self.tester.get_lowest_latency_hosts(
+                    group_name,
+                    [domain],
+                    domain_ips,
+                    self.resolver.max_latency,
+                    latency_task_id,
+                )
+            finally:
+                # 隐藏延迟测试进度条
+                self.progress.update(latency_task_id, visible=False)
+            if fastest_ips:
+                entries.extend(f"{ip}\t{domain}" for ip, latency in fastest_ips)
+            else:
+                logging.warning(f"{domain} 未发现满足延迟检测要求的IP。")
+
+        # 主进度更新
+        self.progress.update(
+            group_task_id,
+            advance=1,
+            visible=True,
+        )
+        return entries
+
     async def _process_domain_group(self, group: DomainGroup, index: int) -> List[str]:
         """处理单个域名组"""
         entries = []
-        all_ips = group.ips.copy()
+        all_ips = set(group.ips)
 
         # 创建 seperateGroup 的主进度任务
         seperateGroup_task_id = self.progress.add_task(
@@ -789,43 +1423,26 @@ class HostsUpdater:
         self.tester.set_progress(self.progress, latency_task_id)
 
         if group.group_type == GroupType.SEPARATE:
-            for domain in group.domains:
-                resolved_ips = await self._resolve_domains_batch(
-                    [domain], resolve_task_id
-                )
-                domain_ips = resolved_ips.get(domain, set())
-
-                # 隐藏域名解析进度条
-                self.progress.update(resolve_task_id, visible=False)
-
-                if not domain_ips:
-                    logging.warning(f"{domain} 未解析到任何可用IP。跳过该域名。")
-                    continue
-
-                fastest_ips = await self.tester.get_lowest_latency_hosts(
-                    group.name,
-                    [domain],
-                    domain_ips,
-                    self.resolver.max_latency,
-                    latency_task_id,
-                )
-                if fastest_ips:
-                    entries.extend(f"{ip}\t{domain}" for ip, latency in fastest_ips)
-                else:
-                    logging.warning(f"{domain} 未发现满足延迟检测要求的IP。")
-                # 隐藏延迟测试进度条
-                self.progress.update(latency_task_id, visible=False)
-                # 主进度更新
-                self.progress.update(
-                    seperateGroup_task_id,
-                    advance=1,
-                    visible=True,
-                )
+            # 先并发解析组内全部域名，再并发测试各域名的延迟
+            resolved_ips_dict = await self._resolve_domains_batch(
+                group.domains, resolve_task_id
+            )
+            # 隐藏域名解析进度条
+            self.progress.update(resolve_task_id, visible=False)
 
-                self.progress.update(
-                    seperateGroup_task_id,
-                    visible=False,
+            domain_entries = await asyncio.gather(
+                *(
+                    self._process_separate_domain(
+                        group.name,
+                        domain,
+                        resolved_ips_dict.get(domain, set()),
+                        seperateGroup_task_id,
+                    )
+                    for domain in group.domains
                 )
+            )
+            for domain_entry in domain_entries:
+                entries.extend(domain_entry)
 
             # 标记该组处理完成
             self.progress.update(
@@ -836,10 +1453,17 @@ class HostsUpdater:
             )
 
         else:
-            # 共用主机的域名组
-            resolved_ips_dict = await self._resolve_domains_batch(
-                group.domains, resolve_task_id
-            )
+            # 共用主机的域名组：预设IP立即开始测试，解析出的IP随解析完成陆续加入
+            probe_tasks: Dict[str, asyncio.Task] = {}
+            self.tester.start_probes(all_ips, probe_tasks)
+            try:
+                resolved_ips_dict = await self._resolve_domains_batch(
+                    group.domains, resolve_task_id, probe_tasks
+                )
+            except BaseException:
+                for task in probe_tasks.values():
+                    task.cancel()
+                raise
             # 隐藏域名解析进度条
             self.progress.update(resolve_task_id, visible=False)
             self.progress.update(
@@ -863,6 +1487,7 @@ class HostsUpdater:
                 all_ips,
                 self.resolver.max_latency,
                 latency_task_id,
+                probe_tasks,
             )
             self.progress.update(
                 shareGroup_task_id,
@@ -888,17 +1513,43 @@ class HostsUpdater:
 
         return entries
 
+    async def _process_all_groups(self) -> List[List[str]]:
+        """并发处理所有组，任一组出错时立即取消其余组
+
+        超过 UPDATE_TIMEOUT 仍未完成的组被取消，已完成组的结果照常返回
+        """
+        tasks = {
+            asyncio.ensure_future(self._process_domain_group(group, i)): group
+            for i, group in enumerate(self.domain_groups, 1)
+        }
+        done, pending = set(), set(tasks)
+        try:
+            done, pending = await asyncio.wait(
+                tasks, timeout=UPDATE_TIMEOUT, return_when=asyncio.FIRST_EXCEPTION
+            )
+        finally:
+            for task in pending:
+                task.cancel()
+            # 等待被取消的组结束，再关闭其使用的会话
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+        if pending:
+            timed_out_groups = ", ".join(tasks[task].name for task in pending)
+            logging.error(
+                f"处理域名组超过 {UPDATE_TIMEOUT} 秒，已取消: {timed_out_groups}"
+            )
+        return [task.result() for task in tasks if task in done]
+
     async def update_hosts(self):
         """主更新函数，支持并发进度显示"""
-        cache_valid = self.resolver._is_dns_cache_valid()
-
         with self.progress:
-            # 并发处理所有组
-            tasks = [
-                self._process_domain_group(group, i)
-                for i, group in enumerate(self.domain_groups, 1)
-            ]
-            all_entries_lists = await asyncio.gather(*tasks)
+            try:
+                all_entries_lists = await self._process_all_groups()
+            finally:
+                await self.resolver.aclose()
             all_entries = [entry for entries in all_entries_lists for entry in entries]
 
         if all_entries:
@@ -912,6 +1563,7 @@ class HostsUpdater:
 # -------------------- 权限提升模块-------------------- #
 class PrivilegeManager:
     @staticmethod
+    @lru_cache(maxsize=1)
     def is_admin() -> bool:
         try:
             return os.getuid() == 0
@@ -938,7 +1590,7 @@ class PrivilegeManager:
 
 
 class Config:
-    DOMAIN_GROUPS = [
+    DOMAIN_GROUPS = (
         DomainGroup(
             name="GitHub Services",
             group_type=GroupType.SEPARATE,
@@ -1223,10 +1875,10 @@ class Config:
             ],
             ips={},
         ),
-    ]
+    )
 
     # DNS 服务器
-    DNS_SERVERS = [
+    DNS_SERVERS = (
         "2402:4e00::",  # DNSPod (IPv6)
         "223.5.5.5",  # Alibaba DNS (IPv4)
         "119.29.29.29",  # DNSPod (IPv4)
@@ -1236,32 +1888,30 @@ class Config:
         "114.114.114.114",  # 114 DNS
         "208.67.222.222",  # Open DNS (IPv4)
         "2620:0:ccc::2",  # Open DNS (IPv6)
-    ]
+    )
 
     @staticmethod
-    def get_dns_cache_file() -> Path:
-        """获取 DNS 缓存文件路径，并确保目录存在。"""
+    @lru_cache(maxsize=1)
+    def get_dns_cache_file() -> str:
+        """获取 DNS 缓存文件路径，并确保目录存在。结果在运行期间不变，只计算一次"""
 
         if getattr(sys, "frozen", False):
             # 打包后的执行文件路径
-            # current_dir = Path(sys.executable).resolve().parent
-            # dns_cache_dir = current_dir / "dns_cache"
+            # current_dir = os.path.dirname(os.path.realpath(sys.executable))
+            # dns_cache_dir = os.path.join(current_dir, "dns_cache")
 
             # 获取用户目录下的 .setHosts，以防止没有写入权限
-            dns_cache_dir = (
-                Path(os.getenv("USERPROFILE", os.getenv("HOME")))
-                / ".setHosts"
-                / "dns_cache"
-            )
+            home_dir = os.getenv("USERPROFILE") or os.path.expanduser("~")
+            dns_cache_dir = os.path.join(home_dir, ".setHosts", "dns_cache")
         else:
             # 脚本运行时路径
-            current_dir = Path(__file__).resolve().parent
-            dns_cache_dir = current_dir / "dns_cache"
+            current_dir = os.path.dirname(os.path.realpath(__file__))
+            dns_cache_dir = os.path.join(current_dir, "dns_cache")
 
-        dns_cache_dir.mkdir(parents=True, exist_ok=True)  # 确保目录存在
+        os.makedirs(dns_cache_dir, exist_ok=True)  # 确保目录存在
 
         # (提示：dns_records.json 文件将存储 A、AAAA 等 DNS 资源记录缓存。)
-        return dns_cache_dir / "dns_records.json"  # 返回缓存文件路径
+        return os.path.join(dns_cache_dir, "dns_records.json")  # 返回缓存文件路径
 
 
 # -------------------- 主函数入口 -------------------- #
@@ -1283,6 +1933,7 @@ async def main():
         dns_servers=dns_servers,
         max_latency=args.max_latency,
         dns_cache_file=dns_cache_file,
+        max_concurrent_dns=args.max_concurrent_dns,
     )
 
     # 2.延迟检测
@@ -1321,4 +1972,10 @@ async def main():
 
 
 if __name__ == "__main__":
+    if uvloop is not None:
+        # 基于 libuv 的事件循环，大量并发解析与连接测试时开销更低，同样支持 aiodns
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif aiodns is not None and sys.platform.startswith("win"):
+        # aiodns 依赖 SelectorEventLoop，Windows 默认的 ProactorEventLoop 不受支持
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     asyncio.run(main())